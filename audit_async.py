@@ -0,0 +1,175 @@
+"""
+Background audit writer:
+AuditRepo.record_event() hands events to this module instead of opening a
+database connection per event. A daemon thread drains a bounded queue and
+writes each batch with a single execute_values() INSERT on one long-lived
+connection, committing once per batch.
+
+Events are queued as raw field dicts; they are only serialized to JSON by
+the writer thread, so events dropped on overflow cost no serialization.
+
+flush_audit() blocks until everything queued so far has been written; call it
+at the end of a unit of work that must see its audit rows (and at shutdown).
+
+Set HP_AUDIT_SYNC=1 to bypass the queue and write every event synchronously.
+HP_AUDIT_DISABLED lists event types (comma-separated) that are not recorded.
+"""
+
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+from config import get_config
+from db import get_connection
+
+_INSERT_SQL = "INSERT INTO audit_log (event_type, payload, created_at) VALUES %s"
+
+_Q = queue.Queue(maxsize=20000)
+_STOP = object()
+
+_thread = None
+_thread_lock = threading.Lock()
+
+# Events dropped because the queue was full or a batch write failed.
+_dropped = 0
+_dropped_lock = threading.Lock()
+
+
+def _count_dropped(n: int) -> None:
+    global _dropped
+    with _dropped_lock:
+        _dropped += n
+
+
+def dropped_count() -> int:
+    return _dropped
+
+
+def _close_quietly(conn) -> None:
+    if conn is not None and not conn.closed:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+def _write_batch(conn, batch):
+    """Write one batch in a single transaction. Returns the connection to reuse."""
+    rows = [(event_type, Json(fields), ts) for event_type, fields, ts in batch]
+    # The long-lived connection can be dropped while idle (server restart,
+    # Neon suspending compute); a connection-level failure gets one retry on a
+    # fresh connection before the batch is given up.
+    for attempt in (1, 2):
+        try:
+            if conn is None or conn.closed:
+                conn = get_connection()
+                conn.autocommit = False
+            with conn.cursor() as cur:
+                execute_values(cur, _INSERT_SQL, rows, page_size=len(rows))
+            conn.commit()
+            return conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as ex:
+            _close_quietly(conn)
+            conn = None
+            if attempt == 2:
+                error = ex
+        except Exception as ex:
+            _close_quietly(conn)
+            conn = None
+            error = ex
+            break
+    print(f"Audit writer: dropped {len(batch)} event(s): {error}")
+    _count_dropped(len(batch))
+    return None
+
+
+def _drain() -> None:
+    conn = None
+    settings = get_config().audit
+    flush_s = settings.flush_ms / 1000
+    stopping = False
+    while not stopping:
+        item = _Q.get()
+        if item is _STOP:
+            break
+        if isinstance(item, threading.Event):
+            item.set()
+            continue
+        batch = [item]
+        # Set once this batch is written; flush_audit() callers wait on these.
+        barriers = []
+        deadline = time.monotonic() + flush_s
+        while len(batch) < settings.batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _Q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            if isinstance(item, threading.Event):
+                barriers.append(item)
+                break
+            batch.append(item)
+        conn = _write_batch(conn, batch)
+        for barrier in barriers:
+            barrier.set()
+    if conn is not None and not conn.closed:
+        conn.close()
+
+
+def _ensure_started() -> None:
+    global _thread
+    if _thread is not None:
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_drain, name="audit-writer", daemon=True)
+            _thread.start()
+
+
+def enqueue(event_type: str, fields: dict) -> None:
+    """Queue an audit event; drops it (and counts the drop) if the queue is full."""
+    _ensure_started()
+    try:
+        _Q.put_nowait((event_type, fields, datetime.now(timezone.utc)))
+    except queue.Full:
+        _count_dropped(1)
+
+
+def flush_audit(timeout: float = 5.0) -> bool:
+    """
+    Write out every event queued before this call without waiting for the
+    batch size or flush interval. Returns False if the writer did not catch
+    up within `timeout` seconds.
+    """
+    if _thread is None or not _thread.is_alive():
+        return True
+    barrier = threading.Event()
+    try:
+        _Q.put(barrier, timeout=timeout)
+    except queue.Full:
+        return False
+    return barrier.wait(timeout)
+
+
+def _flush_and_join(timeout: float = 10.0) -> None:
+    """Write out everything still queued before the interpreter exits."""
+    if _thread is None or not _thread.is_alive():
+        return
+    try:
+        _Q.put(_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    _thread.join(timeout)
+
+
+atexit.register(_flush_and_join)
@@ -6,8 +6,8 @@ business logic to these Commands.
 """
 
 from abc import ABC, abstractmethod
-from datetime import date, datetime, timezone
-from typing import Optional, List
+from datetime import date
+from typing import Iterator, Optional
 
 from services.patient_service import register_patient
 from services.prescription_service import (
@@ -16,7 +16,7 @@ from services.prescription_service import (
 )
 from services.qr_service import generate_qr_for_prescription
 from repositories import PatientRepo, PrescriptionRepo, AuditRepo
-from models import Prescription
+from models import RxStatus
 from notifier import NotifierFactory
 
 
@@ -44,7 +44,7 @@ class AddPatientCommand(Command):
         self.email = email
 
     def execute(self) -> None:
-        patient = register_patient(
+        self.run_inline(
             health_card_no=self.health_card_no,
             first_name=self.first_name,
             last_name=self.last_name,
@@ -52,11 +52,28 @@ class AddPatientCommand(Command):
             phone=self.phone,
             email=self.email,
         )
-        # AUDIT: patient created
-        AuditRepo.record_event(
-            "PATIENT_CREATED",
-            f"patient_id={patient.id};hcn={patient.health_card_no}",
+
+    @classmethod
+    def run_inline(
+        cls,
+        health_card_no: str,
+        first_name: str,
+        last_name: str,
+        dob: date,
+        phone: Optional[str],
+        email: Optional[str],
+    ) -> None:
+        """Same as execute(), without building a single-use Command object."""
+        # AUDIT: PATIENT_CREATED is written together with the insert
+        register_patient(
+            health_card_no=health_card_no,
+            first_name=first_name,
+            last_name=last_name,
+            dob=dob,
+            phone=phone,
+            email=email,
         )
+        PatientRepo.invalidate_cached(health_card_no)
 
 
 class NewPrescriptionCommand(Command):
@@ -78,18 +95,14 @@ class NewPrescriptionCommand(Command):
         patient = PatientRepo.get_by_health_card(self.health_card_no)
         if not patient:
             raise ValueError("No patient found with that health card number.")
-        prescription = create_prescription_for_patient(
+        # AUDIT: RX_CREATED is written together with the insert
+        create_prescription_for_patient(
             patient_id=patient.id,
             drug_name=self.drug_name,
             dosage=self.dosage,
             instructions=self.instructions,
             days_valid=self.days_valid,
         )
-        # AUDIT: prescription created
-        AuditRepo.record_event(
-            "RX_CREATED",
-            f"prescription_id={prescription.id};patient_id={patient.id}",
-        )
 
 
 class GeneratePickupQRCommand(Command):
@@ -97,6 +110,7 @@ class GeneratePickupQRCommand(Command):
         self.prescription_id = prescription_id
 
     def execute(self) -> None:
+        # waits for the render, so this only reports an image that exists
         path = generate_qr_for_prescription(self.prescription_id)
         # qr_service already audits QR_GENERATED
         print(f"QR image generated at {path}")
@@ -106,41 +120,41 @@ class DispensePrescriptionCommand(Command):
         self.pickup_code = pickup_code
 
     def execute(self) -> None:
-        p = PrescriptionRepo.get_by_pickup_code(self.pickup_code)
-        if not p:
+        # Status and expiry are checked in SQL; AUDIT: RX_DISPENSED is written
+        # in the same statement as the update.
+        result = PrescriptionRepo.dispense_by_pickup_code(self.pickup_code)
+        if result is None:
             raise ValueError("No prescription found for that pickup code.")
 
-        if p.status == "DISPENSED":
+        status, expired, dispensed = result
+        if dispensed:
+            return
+        if status == RxStatus.DISPENSED:
             raise ValueError("Prescription already dispensed.")
-
-        if p.expires_at is not None:
-            now_utc = datetime.now(timezone.utc)
-            if p.expires_at < now_utc:
-                raise ValueError("Prescription has expired and cannot be dispensed.")
-
-        PrescriptionRepo.mark_dispensed(p.id)
-
-        # AUDIT: prescription dispensed
-        AuditRepo.record_event(
-            "RX_DISPENSED",
-            f"prescription_id={p.id};pickup_code={self.pickup_code}",
-        )
+        if expired:
+            raise ValueError("Prescription has expired and cannot be dispensed.")
 
 class ReportDispensedCommand(Command):
     """
     Generate a report of all dispensed prescriptions.
 
-    The Command sets self.rows to a list of Prescription domain objects.
+    The Command sets self.rows to an iterator over report tuples (see
+    PrescriptionRepo.iter_dispensed) streamed from a server-side cursor, so the
+    report is never held in memory. self.count is final once rows is exhausted.
     The CLI layer is responsible for formatting/printing the report.
     """
     def __init__(self) -> None:
-        self.rows: List[Prescription] = []
+        self.rows: Iterator[tuple] = iter(())
+        self.count = 0
 
     def execute(self) -> None:
-        self.rows = PrescriptionRepo.list_dispensed()
+        self.count = 0
+        self.rows = self._stream()
+
+    def _stream(self) -> Iterator[tuple]:
+        for row in PrescriptionRepo.iter_dispensed():
+            self.count += 1
+            yield row
         # optional audit: that a report was generated
-        AuditRepo.record_event(
-            "REPORT_DISPENSED_GENERATED",
-            f"count={len(self.rows)}",
-        )
+        AuditRepo.record_event("REPORT_DISPENSED_GENERATED", count=self.count)
 
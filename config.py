@@ -1,5 +1,8 @@
 import os
 from dataclasses import dataclass
+from functools import lru_cache
+
+NOTIFIER_KINDS = ("email", "sms")
 
 @dataclass
 class DatabaseConfig:
@@ -9,33 +12,105 @@ class DatabaseConfig:
     name: str
     user: str
     password: str
+    pool_min: int  # connections opened up front
+    pool_max: int
+    # Server-side prepared statements need a session-level connection, so they
+    # are off by default: transaction-mode poolers (PgBouncer, Neon's "-pooler"
+    # endpoints) route EXECUTE to backends that never saw the PREPARE.
+    prepare: bool
 
 @dataclass
 class QRServiceConfig:
-    base_url: str
     output_dir: str
 
+@dataclass
+class AuditConfig:
+    sync: bool  # write each event synchronously instead of batching
+    batch: int  # max events per batched write
+    flush_ms: int  # max time a batch waits before being written
+    disabled: frozenset[str]  # event types that are not recorded
+
 @dataclass
 class AppConfig:
     db: DatabaseConfig
     qr: QRServiceConfig
+    audit: AuditConfig
+    notifier_kind: str
+    hcn_key: bytes  # BLAKE2b key for health card lookup hashes (1-64 bytes, required)
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, str(default))
+    try:
+        return int(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer; got {raw!r}") from None
+
+def _env_flag(name: str) -> bool:
+    raw = os.getenv(name, "0")
+    if raw not in ("0", "1"):
+        raise ValueError(f"{name} must be 0 or 1; got {raw!r}")
+    return raw == "1"
 
 def load_config() -> AppConfig:
     return AppConfig(
         db=DatabaseConfig(
             dsn=os.getenv("HP_DB_DSN"),  # NEW
             host=os.getenv("HP_DB_HOST", "localhost"),
-            port=int(os.getenv("HP_DB_PORT", "5432")),
+            port=_env_int("HP_DB_PORT", 5432),
             name=os.getenv("HP_DB_NAME", "healthpass"),
             user=os.getenv("HP_DB_USER", "healthpass"),
             password=os.getenv("HP_DB_PASSWORD", "healthpass"),
+            pool_min=_env_int("HP_DB_POOL_MIN", 2),
+            pool_max=_env_int("HP_DB_POOL_MAX", 20),
+            prepare=_env_flag("HP_DB_PREPARE"),
         ),
         qr=QRServiceConfig(
-            # Simple free QR API – good enough for demo
-            base_url=os.getenv(
-                "HP_QR_BASE_URL",
-                "https://api.qrserver.com/v1/create-qr-code/"
-            ),
             output_dir=os.getenv("HP_QR_OUTPUT_DIR", "qr_codes"),
         ),
+        audit=AuditConfig(
+            sync=_env_flag("HP_AUDIT_SYNC"),
+            batch=_env_int("HP_AUDIT_BATCH", 256),
+            flush_ms=_env_int("HP_AUDIT_FLUSH_MS", 200),
+            disabled=frozenset(
+                e.strip()
+                for e in os.getenv("HP_AUDIT_DISABLED", "").split(",")
+                if e.strip()
+            ),
+        ),
+        notifier_kind=os.getenv("HP_NOTIFY_TYPE", "email").lower(),
+        # No default: a key in the source would make the hash unkeyed in
+        # practice. init_schema() refuses a key that differs from the one the
+        # database was hashed with.
+        hcn_key=os.getenv("HP_HCN_KEY", "").encode("utf-8"),
     )
+
+# The environment is read once per process; call get_config.cache_clear()
+# to pick up changes.
+@lru_cache(maxsize=1)
+def get_config() -> AppConfig:
+    return load_config()
+
+def validate_env() -> AppConfig:
+    """Resolve the config once at startup and fail fast on invalid settings."""
+    config = get_config()
+    if config.notifier_kind not in NOTIFIER_KINDS:
+        raise ValueError(
+            f"HP_NOTIFY_TYPE must be one of {', '.join(NOTIFIER_KINDS)}; "
+            f"got {config.notifier_kind!r}"
+        )
+    if not config.hcn_key:
+        raise ValueError("HP_HCN_KEY must be set (a secret of up to 64 bytes)")
+    if len(config.hcn_key) > 64:
+        raise ValueError("HP_HCN_KEY must be at most 64 bytes")
+    if config.db.pool_min < 1:
+        raise ValueError(f"HP_DB_POOL_MIN must be at least 1; got {config.db.pool_min}")
+    if config.db.pool_max < config.db.pool_min:
+        raise ValueError(
+            f"HP_DB_POOL_MAX ({config.db.pool_max}) must be at least "
+            f"HP_DB_POOL_MIN ({config.db.pool_min})"
+        )
+    if config.audit.batch < 1:
+        raise ValueError(f"HP_AUDIT_BATCH must be at least 1; got {config.audit.batch}")
+    if config.audit.flush_ms < 0:
+        raise ValueError(f"HP_AUDIT_FLUSH_MS must not be negative; got {config.audit.flush_ms}")
+    return config
@@ -1,7 +1,11 @@
-from datetime import date
+from datetime import date, datetime
 import csv
+import sys
+from itertools import islice
 from pathlib import Path
 import os
+from audit_async import flush_audit
+from config import get_config, validate_env
 from db import init_schema
 from command import (
     AddPatientCommand,
@@ -10,60 +14,120 @@ from command import (
     DispensePrescriptionCommand,
     ReportDispensedCommand
 )
+from models import RxStatus
 from repositories import PatientRepo, AuditRepo, PrescriptionRepo
-from services.prescription_service import list_prescriptions
+from services.patient_service import register_patients_bulk
+from services.prescription_service import create_prescriptions_bulk, list_prescription_summaries
 from services.qr_service import ensure_pickup_code_and_qr
 from notifier import NotifierFactory
 
+# How long action_notify waits for a pending QR render before sending without it.
+QR_RENDER_WAIT_S = 5.0
+
 REPORTS_DIR = Path("reports")
 REPORTS_DIR.mkdir(parents=True, exist_ok=True)
 REPORT_CSV_PATH = REPORTS_DIR / "dispensed_prescriptions.csv"
 
+_DOCTOR_PROMPT = (
+    "\n=== Doctor Menu ===\n"
+    "1) Add patient\n"
+    "2) Add prescription\n"
+    "3) List prescriptions for patient\n"
+    "4) Generate pickup QR directly (Command)\n"
+    "5) Bulk import patients from CSV\n"
+    "6) Bulk import prescriptions from CSV\n"
+    "0) Back to role selection\n"
+)
+
+_PHARMACIST_PROMPT = (
+    "\n=== Pharmacist Menu ===\n"
+    "1) List prescriptions for patient\n"
+    "2) Dispense prescription by pickup code\n"
+    "3) Notify prescription ready (Factory Method)\n"
+    "4) Report dispensed prescriptions\n"
+    "0) Back to role selection\n"
+)
+
+_ROLE_PROMPT = (
+    "\n=== HealthPass Role Selection ===\n"
+    "1) Doctor\n"
+    "2) Pharmacist\n"
+    "0) Exit\n"
+)
+
+
+_REPORT_CSV_HEADER = (
+    "id",
+    "patient_id",
+    "patient_first_name",
+    "patient_last_name",
+    "drug_name",
+    "dosage",
+    "status",
+    "pickup_code",
+    "picked_up_at",
+    "created_at",
+    "expires_at",
+)
 
-def _export_dispensed_to_csv(rows):
+
+def _export_dispensed_to_csv() -> None:
     """
     Overwrite the CSV with the full list of dispensed prescriptions.
-    'rows' is a list[Prescription], already containing all DISPENSED rows.
+    Rows are streamed from PrescriptionRepo.iter_dispensed() straight into a
+    1 MiB-buffered writer, so the export never holds the whole report in memory.
+    The file is written next to the report and swapped in with os.replace(),
+    so readers never see a half-written CSV.
     """
-    with open(REPORT_CSV_PATH, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(
-            [
-                "id",
-                "patient_id",
-                "drug_name",
-                "dosage",
-                "status",
-                "pickup_code",
-                "picked_up_at",
-                "created_at",
-                "expires_at",
-            ]
-        )
-        for p in rows:
-            writer.writerow(
-                [
-                    p.id,
-                    p.patient_id,
-                    p.drug_name,
-                    p.dosage,
-                    p.status,
-                    p.pickup_code or "",
-                    p.picked_up_at.isoformat() if p.picked_up_at else "",
-                    p.created_at.isoformat() if p.created_at else "",
-                    p.expires_at.isoformat() if p.expires_at else "",
-                ]
+    count = 0
+
+    def csv_rows():
+        nonlocal count
+        iso = datetime.isoformat
+        for r in PrescriptionRepo.iter_dispensed():
+            count += 1
+            picked_up_at, created_at, expires_at = r[8], r[9], r[10]
+            yield r[:6] + (
+                RxStatus(r[6]).name,
+                r[7] or "",
+                iso(picked_up_at) if picked_up_at else "",
+                iso(created_at) if created_at else "",
+                iso(expires_at) if expires_at else "",
             )
 
+    tmp_path = REPORT_CSV_PATH.with_name(REPORT_CSV_PATH.name + ".tmp")
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+            writer = csv.writer(f)
+            writer.writerow(_REPORT_CSV_HEADER)
+            writer.writerows(csv_rows())
+        os.replace(tmp_path, REPORT_CSV_PATH)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
     # audit export itself
     AuditRepo.record_event(
-        "REPORT_DISPENSED_EXPORTED",
-        f"path={REPORT_CSV_PATH};count={len(rows)}",
+        "REPORT_DISPENSED_EXPORTED", path=str(REPORT_CSV_PATH), count=count
     )
 
+# When stdin is piped (demo scripts, smoke tests) prompts are not echoed and
+# lines are read straight from stdin, avoiding a prompt write + flush per read.
+_IS_TTY = sys.stdin.isatty()
+
+
+def _input(prompt: str = "") -> str:
+    if _IS_TTY:
+        return input(prompt)
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line.rstrip("\r\n")
+
+
 def _read_non_empty(prompt: str) -> str:
     while True:
-        val = input(prompt).strip()
+        val = _input(prompt).strip()
         if val:
             return val
         print("Value cannot be empty.")
@@ -71,7 +135,7 @@ def _read_non_empty(prompt: str) -> str:
 
 def _read_int(prompt: str) -> int:
     while True:
-        s = input(prompt).strip()
+        s = _input(prompt).strip()
         try:
             return int(s)
         except ValueError:
@@ -80,11 +144,9 @@ def _read_int(prompt: str) -> int:
 
 def _read_date(prompt: str) -> date:
     while True:
-        s = input(prompt).strip()
         try:
-            y, m, d = map(int, s.split("-"))
-            return date(y, m, d)
-        except Exception:
+            return date.fromisoformat(_input(prompt).strip())
+        except ValueError:
             print("Use format YYYY-MM-DD (e.g., 1990-01-31).")
 
 
@@ -100,30 +162,145 @@ def action_add_patient():
     first = _read_non_empty("First name: ")
     last = _read_non_empty("Last name: ")
     dob = _read_date("Date of birth (YYYY-MM-DD): ")
-    phone = input("Phone (optional): ").strip() or None
-    email = input("Email (optional): ").strip() or None
+    phone = _input("Phone (optional): ").strip() or None
+    email = _input("Email (optional): ").strip() or None
 
-    cmd = AddPatientCommand(
-        health_card_no=hcn,
-        first_name=first,
-        last_name=last,
-        dob=dob,
-        phone=phone,
-        email=email,
-    )
     try:
-        cmd.execute()
+        AddPatientCommand.run_inline(
+            health_card_no=hcn,
+            first_name=first,
+            last_name=last,
+            dob=dob,
+            phone=phone,
+            email=email,
+        )
         print("Patient created.")
     except Exception as ex:
         print("Error while creating patient:", ex)
 
 
+_CSV_REQUIRED = {"health_card_no", "first_name", "last_name", "date_of_birth",
+                 "drug_name", "dosage"}
+_PATIENT_CSV_COLUMNS = ("health_card_no", "first_name", "last_name", "date_of_birth",
+                        "phone", "email")
+_PRESCRIPTION_CSV_COLUMNS = ("health_card_no", "drug_name", "dosage", "instructions",
+                             "days_valid")
+
+
+def _read_csv_chunks(path: Path, parse, errors: list, size: int = 1000):
+    """
+    Yield the data rows of a CSV (header skipped), converted by `parse`, in
+    lists of up to `size` rows. Blank lines are skipped; rows `parse` rejects
+    with ValueError are left out and recorded in `errors` as (line, message).
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        chunk = []
+        for fields in reader:
+            if not any(field.strip() for field in fields):
+                continue
+            try:
+                chunk.append(parse(fields))
+            except ValueError as ex:
+                errors.append((reader.line_num, str(ex)))
+                continue
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _csv_fields(fields: list, names: tuple) -> list:
+    """Stripped fields of one CSV row; ValueError on a wrong column count or missing value."""
+    if len(fields) != len(names):
+        raise ValueError(f"expected {len(names)} columns, got {len(fields)}")
+    fields = [field.strip() for field in fields]
+    for name, value in zip(names, fields):
+        if not value and name in _CSV_REQUIRED:
+            raise ValueError(f"{name} is empty")
+    return fields
+
+
+def _parse_patient_row(fields: list) -> tuple:
+    hcn, first, last, dob, phone, email = _csv_fields(fields, _PATIENT_CSV_COLUMNS)
+    return hcn, first, last, date.fromisoformat(dob), phone or None, email or None
+
+
+def _parse_prescription_row(fields: list) -> tuple:
+    hcn, drug_name, dosage, instructions, days_valid = _csv_fields(
+        fields, _PRESCRIPTION_CSV_COLUMNS
+    )
+    if not days_valid:
+        days = 7
+    elif days_valid.isdigit():
+        days = int(days_valid)
+    else:
+        raise ValueError(f"days_valid must be a whole number; got {days_valid!r}")
+    return hcn, drug_name, dosage, instructions or None, days
+
+
+def _report_csv_errors(errors: list, limit: int = 20) -> None:
+    if not errors:
+        return
+    print(f"Skipped {len(errors)} malformed row(s):")
+    for line, message in errors[:limit]:
+        print(f"  line {line}: {message}")
+    if len(errors) > limit:
+        print(f"  ... and {len(errors) - limit} more")
+
+
+# Bulk-loads patients from a CSV with a header row and the columns
+# health_card_no,first_name,last_name,date_of_birth,phone,email.
+# Rows are read 1000 at a time and go to the database in one COPY per chunk
+# rather than one command each. Blank lines are ignored and malformed rows are
+# reported by line number without stopping the import.
+def action_bulk_import_patients():
+    print("\n== Bulk Import Patients (CSV) ==")
+    path = Path(_read_non_empty("CSV file path: "))
+    imported = skipped = 0
+    errors = []
+    try:
+        for rows in _read_csv_chunks(path, _parse_patient_row, errors):
+            ids = register_patients_bulk(rows)
+            imported += len(ids)
+            skipped += len(rows) - len(ids)
+    except Exception as ex:
+        print("Error while importing patients:", ex)
+    print(f"Imported {imported} patient(s); skipped {skipped} existing.")
+    _report_csv_errors(errors)
+
+
+# Bulk-loads prescriptions from a CSV with a header row and the columns
+# health_card_no,drug_name,dosage,instructions,days_valid (days_valid may be
+# blank for the default of 7). Blank lines and malformed rows are handled as
+# for patients.
+def action_bulk_import_prescriptions():
+    print("\n== Bulk Import Prescriptions (CSV) ==")
+    path = Path(_read_non_empty("CSV file path: "))
+    imported = 0
+    unknown = []
+    errors = []
+    try:
+        for rows in _read_csv_chunks(path, _parse_prescription_row, errors):
+            ids, missing = create_prescriptions_bulk(rows)
+            imported += len(ids)
+            unknown.extend(missing)
+    except Exception as ex:
+        print("Error while importing prescriptions:", ex)
+    print(f"Imported {imported} prescription(s).")
+    if unknown:
+        print(f"Skipped {len(unknown)} row(s) with unknown health card numbers.")
+    _report_csv_errors(errors)
+
+
 def action_add_prescription():
     print("\n== New Prescription ==")
     hcn = _read_non_empty("Patient health card number: ")
     drug_name = _read_non_empty("Drug name: ")
     dosage = _read_non_empty("Dosage: ")
-    instructions = input("Instructions (optional): ").strip() or None
+    instructions = _input("Instructions (optional): ").strip() or None
     days_valid = _read_int("Days valid (default 7): ") or 7
 
     cmd = NewPrescriptionCommand(
@@ -148,7 +325,7 @@ def action_list_prescriptions():
         print("No patient found with that health card number.")
         return
 
-    presc = list_prescriptions(patient.id)
+    presc = list_prescription_summaries(patient.id)
     if not presc:
         print("No prescriptions found for this patient.")
         return
@@ -157,7 +334,7 @@ def action_list_prescriptions():
     for p in presc:
         print(
             f"- ID={p.id}, drug={p.drug_name}, dosage={p.dosage}, "
-            f"status={p.status}, pickup_code={p.pickup_code or '-'}"
+            f"status={p.status.name}, pickup_code={p.pickup_code or '-'}"
         )
 
 # Pharmacist notification workflow:
@@ -176,23 +353,20 @@ def action_notify():
     if not p:
         print("No prescription found with that ID.")
         return
-    if p.status== "DISPENSED":
+    if p.status == RxStatus.DISPENSED:
         print("Prescription already dispensed; cannot notify.")
         return
-    patient = PatientRepo.get_by_id(p.id)
+    patient = PatientRepo.get_for_prescription(prescription_id)
     if not patient:
         print("No patient found for this prescription.")
         return
 
-    # Determine channel from env
-    kind = os.getenv("HP_NOTIFY_TYPE", "email").lower()
-    if kind not in ("email", "sms"):
-        print("HP_NOTIFY_TYPE must be 'email' or 'sms'. Current value:", kind)
-        return
+    # Channel comes from HP_NOTIFY_TYPE, validated at startup
+    kind = get_config().notifier_kind
 
     # Ensure contact is present; if missing, prompt pharmacist and save it
     if kind == "email" and not patient.email:
-        new_email = input(
+        new_email = _input(
             "Patient email is missing. Enter email to use (leave blank to cancel): "
         ).strip()
         if not new_email:
@@ -202,7 +376,7 @@ def action_notify():
         patient.email = new_email
 
     if kind == "sms" and not patient.phone:
-        new_phone = input(
+        new_phone = _input(
             "Patient phone is missing. Enter phone to use (leave blank to cancel): "
         ).strip()
         if not new_phone:
@@ -212,15 +386,23 @@ def action_notify():
         patient.phone = new_phone
 
     # Ask whether to include QR in the message
-    include_qr_answer = input(
+    include_qr_answer = _input(
         "Include QR code in the notification? [y/N]: "
     ).strip().lower()
     include_qr = include_qr_answer == "y"
 
     # Ensure pickup code (+ QR file) exist
-    pickup_code, qr_path = ensure_pickup_code_and_qr(prescription_id)
+    pickup_code, qr_path, render = ensure_pickup_code_and_qr(prescription_id)
     if not include_qr:
         qr_path = None  # we still have it in DB, but we don't expose it in the message
+    elif render is not None:
+        # Don't send a path to an image that was never written; a failed render
+        # is retried by the next ensure_pickup_code_and_qr call.
+        try:
+            render.result(timeout=QR_RENDER_WAIT_S)
+        except Exception as ex:
+            print("QR image could not be rendered; sending without it:", str(ex) or "timed out")
+            qr_path = None
 
     notifier = NotifierFactory.create()
     try:
@@ -259,84 +441,82 @@ def action_dispense():
 def action_report_dispensed():
     print("\n== Report: Dispensed Prescriptions ==")
     cmd = ReportDispensedCommand()
+    cmd.execute()  # only sets up the stream; the query runs in the loop below
+
+    # Rows are printed as they stream in; the total is only known at the end.
     try:
-        cmd.execute()
+        for (rx_id, patient_id, first_name, last_name, drug_name, dosage, _status,
+             pickup_code, picked_up_at, created_at, _expires_at) in cmd.rows:
+            if cmd.count == 1:
+                print("-" * 72)
+            print(
+                f"ID={rx_id} patient_id={patient_id} "
+                f"patient={first_name} {last_name} "
+                f"drug={drug_name} dosage={dosage} "
+                f"pickup_code={pickup_code or '-'} "
+                f"picked_up_at={picked_up_at or created_at}"
+            )
     except Exception as ex:
         print("Error while generating report:", ex)
         return
 
-    rows = cmd.rows
-    if not rows:
+    if not cmd.count:
         print("No dispensed prescriptions found.")
         return
-
-    print(f"Total dispensed prescriptions: {len(rows)}")
     print("-" * 72)
-    for p in rows:
-        picked = p.picked_up_at or p.created_at
-        print(
-            f"ID={p.id} patient_id={p.patient_id} "
-            f"drug={p.drug_name} dosage={p.dosage} "
-            f"pickup_code={p.pickup_code or '-'} "
-            f"picked_up_at={picked}"
-        )
+    print(f"Total dispensed prescriptions: {cmd.count}")
 
     # ask user if they want export
-    choice = input("Export this report to CSV? [y/N]: ").strip().lower()
+    choice = _input("Export this report to CSV? [y/N]: ").strip().lower()
     if choice == "y":
-        _export_dispensed_to_csv(rows)
+        _export_dispensed_to_csv()
         print(f"Report exported to {REPORT_CSV_PATH}")
 
-def doctor_menu():
+
+def _invalid_choice():
+    print("Invalid choice. Please select a valid option.")
+
+
+# Menu option -> action. Menus look the choice up here instead of walking an
+# if/elif chain; "0" (back/exit) is handled by the menu loop itself.
+_DOCTOR_ACTIONS = {
+    "1": action_add_patient,
+    "2": action_add_prescription,
+    "3": action_list_prescriptions,
+    "4": action_generate_qr_direct,
+    "5": action_bulk_import_patients,
+    "6": action_bulk_import_prescriptions,
+}
+
+_PHARMACIST_ACTIONS = {
+    "1": action_list_prescriptions,
+    "2": action_dispense,
+    "3": action_notify,
+    "4": action_report_dispensed,
+}
+
+
+def _run_menu(prompt: str, actions: dict, select_label: str) -> None:
     while True:
-        print(
-            "\n=== Doctor Menu ===\n"
-            "1) Add patient\n"
-            "2) Add prescription\n"
-            "3) List prescriptions for patient\n"
-            "4) Generate pickup QR directly (Command)\n"
-            "0) Back to role selection\n"
-        )
-        choice = input("Select option: ").strip()
-
-        if choice == "1":
-            action_add_patient()
-        elif choice == "2":
-            action_add_prescription()
-        elif choice == "3":
-            action_list_prescriptions()
-        elif choice == "4":
-            action_generate_qr_direct()
-        elif choice == "0":
-            break
-        else:
-            print("Invalid choice. Please select a valid option.")
+        print(prompt)
+        choice = _input(select_label).strip()
+        if choice == "0":
+            return
+        actions.get(choice, _invalid_choice)()
+
+
+def doctor_menu():
+    _run_menu(_DOCTOR_PROMPT, _DOCTOR_ACTIONS, "Select option: ")
 
 
 def pharmacist_menu():
-    while True:
-        print(
-            "\n=== Pharmacist Menu ===\n"
-            "1) List prescriptions for patient\n"
-            "2) Dispense prescription by pickup code\n"
-            "3) Notify prescription ready (Factory Method)\n"
-            "4) Report dispensed prescriptions\n"
-            "0) Back to role selection\n"
-        )
-        choice = input("Select option: ").strip()
-
-        if choice == "1":
-            action_list_prescriptions()
-        elif choice == "2":
-            action_dispense()
-        elif choice == "3":
-            action_notify()
-        elif choice == "4":
-            action_report_dispensed()
-        elif choice == "0":
-            break
-        else:
-            print("Invalid choice. Please select a valid option.")
+    _run_menu(_PHARMACIST_PROMPT, _PHARMACIST_ACTIONS, "Select option: ")
+
+
+_ROLE_MENUS = {
+    "1": doctor_menu,
+    "2": pharmacist_menu,
+}
 
 
 """
@@ -345,21 +525,18 @@ and delegates actual work to Command objects.
 """
          
 def main_menu():
-    while True:
-        print(
-            "\n=== HealthPass Role Selection ===\n"
-            "1) Doctor\n"
-            "2) Pharmacist\n"
-            "0) Exit\n"
-        )
-        choice = input("Select role: ").strip()
-
-        if choice == "1":
-            doctor_menu()
-        elif choice == "2":
-            pharmacist_menu()
-        elif choice == "0":
-            print("Goodbye.")
-            break
-        else:
-            print("Invalid choice. Please select a valid option.")
+    try:
+        validate_env()
+    except ValueError as ex:
+        print("Configuration error:", ex)
+        return
+    # Interactive session with stdout redirected (e.g. piped through tee):
+    # write through so prompts show up before input is read.
+    if _IS_TTY and not sys.stdout.isatty():
+        sys.stdout.reconfigure(write_through=True)
+    try:
+        _run_menu(_ROLE_PROMPT, _ROLE_MENUS, "Select role: ")
+    finally:
+        # Make sure the session's queued audit events reach audit_log.
+        flush_audit()
+    print("Goodbye.")
@@ -1,6 +1,16 @@
+import sys
+
+from config import validate_env
 from console_cli import main_menu
 from db import init_schema
 
 if __name__ == "__main__":
+    # Validate before touching the database, so bad settings fail fast and
+    # before any DDL or migration runs.
+    try:
+        validate_env()
+    except ValueError as ex:
+        print("Configuration error:", ex)
+        sys.exit(1)
     init_schema()
-    main_menu()
\ No newline at end of file
+    main_menu()
@@ -1,10 +1,17 @@
 from dataclasses import dataclass
 from datetime import date, datetime
+from enum import IntEnum
 from typing import Optional
 
+# Prescription status, stored as a SMALLINT in the database.
+class RxStatus(IntEnum):
+    ACTIVE = 1
+    DISPENSED = 2
+    EXPIRED = 3
+
 # Simple domain models used throughout the application. These are returned by
 # repositories and passed into commands and services.
-@dataclass
+@dataclass(slots=True)
 class Patient:
     id: Optional[int]
     health_card_no: str
@@ -15,23 +22,34 @@ class Patient:
     email: Optional[str] = None
     created_at: Optional[datetime] = None
 
-@dataclass
+@dataclass(slots=True)
 class Prescription:
     id: Optional[int]
     patient_id: int
     drug_name: str
     dosage: str
     instructions: Optional[str]
-    status: str = "ACTIVE"
+    status: RxStatus = RxStatus.ACTIVE
     pickup_code: Optional[str] = None
     pickup_qr_path: Optional[str] = None
     expires_at: Optional[datetime] = None
     created_at: Optional[datetime] = None
     picked_up_at: Optional[datetime] = None
 
-@dataclass
+# Narrow read model for prescription listings: no instructions, QR path or
+# timestamps beyond created_at. Use Prescription when the full row is needed.
+@dataclass(slots=True)
+class PrescriptionSummary:
+    id: int
+    drug_name: str
+    dosage: str
+    status: RxStatus
+    pickup_code: Optional[str]
+    created_at: datetime
+
+@dataclass(slots=True)
 class AuditLog:
     id: Optional[int]
     event_type: str
-    payload: Optional[str] = None
+    payload: Optional[dict] = None
     created_at: Optional[datetime] = None
\ No newline at end of file
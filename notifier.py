@@ -1,14 +1,15 @@
 """
 Factory Method Pattern:
 NotifierFactory.create() returns an EmailNotifier or SMSNotifier based on the
-HP_NOTIFY_TYPE environment variable. The rest of the code only depends on the
+HP_NOTIFY_TYPE setting (AppConfig.notifier_kind). The rest of the code only depends on the
 Notifier interface, not on concrete implementations.
 """
 
 from abc import ABC, abstractmethod
+from functools import lru_cache
 from typing import Optional
-import os
 
+from config import get_config
 from models import Patient
 from repositories import AuditRepo
 
@@ -37,8 +38,7 @@ class EmailNotifier(Notifier):
     ) -> None:
         if not patient.email:
             AuditRepo.record_event(
-                "NOTIFY_EMAIL_SKIPPED",
-                f"patient_id={patient.id};reason=no_email",
+                "NOTIFY_EMAIL_SKIPPED", patient_id=patient.id, reason="no_email"
             )
             print("EmailNotifier: no email for patient; skipping.")
             return
@@ -57,7 +57,10 @@ class EmailNotifier(Notifier):
 
         AuditRepo.record_event(
             "NOTIFY_EMAIL",
-            f"patient_id={patient.id};to={patient.email};pickup_code={pickup_code};qr_included={bool(qr_path)}",
+            patient_id=patient.id,
+            to=patient.email,
+            pickup_code=pickup_code,
+            qr_included=bool(qr_path),
         )
 
 
@@ -70,8 +73,7 @@ class SMSNotifier(Notifier):
     ) -> None:
         if not patient.phone:
             AuditRepo.record_event(
-                "NOTIFY_SMS_SKIPPED",
-                f"patient_id={patient.id};reason=no_phone",
+                "NOTIFY_SMS_SKIPPED", patient_id=patient.id, reason="no_phone"
             )
             print("SMSNotifier: no phone for patient; skipping.")
             return
@@ -91,21 +93,39 @@ class SMSNotifier(Notifier):
 
         AuditRepo.record_event(
             "NOTIFY_SMS",
-            f"patient_id={patient.id};to={patient.phone};pickup_code={pickup_code};qr_included={bool(qr_path)}",
+            patient_id=patient.id,
+            to=patient.phone,
+            pickup_code=pickup_code,
+            qr_included=bool(qr_path),
         )
 
 
+_KINDS = {
+    "email": EmailNotifier,
+    "sms": SMSNotifier,
+}
+
+
 class NotifierFactory:
     """
     HP_NOTIFY_TYPE = 'email' | 'sms'
     Default to 'email' if not set.
+
+    The kind is resolved once into AppConfig (validated at startup by
+    validate_env()), so the created notifier is cached; call invalidate() to
+    pick up a changed environment.
     """
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def create() -> Notifier:
-        kind = os.getenv("HP_NOTIFY_TYPE", "email").lower()
-        if kind == "email":
-            return EmailNotifier()
-        if kind == "sms":
-            return SMSNotifier()
-        raise ValueError("Unknown notifier type: %s" % kind)
+        kind = get_config().notifier_kind
+        try:
+            return _KINDS[kind]()
+        except KeyError:
+            raise ValueError("Unknown notifier type: %s" % kind) from None
+
+    @staticmethod
+    def invalidate() -> None:
+        get_config.cache_clear()
+        NotifierFactory.create.cache_clear()
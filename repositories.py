@@ -4,59 +4,133 @@ All SQL access is centralized here. Higher layers work with Patient and Prescrip
 domain objects instead of raw database rows or psycopg2 cursors.
 """
 
-from typing import Optional, List,Tuple
-from db import db_cursor
-from models import Patient, Prescription,AuditLog
-from datetime import datetime
+import threading
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple
+from cachetools import TTLCache
+from psycopg2.extras import Json, execute_values
+from config import get_config
+from db import copy_rows_binary, db_cursor, health_card_hash, prepared_sql
+from models import Patient, Prescription, PrescriptionSummary, RxStatus
+import audit_async
 
-# Health card numbers are stored hex-encoded in the database for privacy.
-# These helpers convert between plain text and hex at the repository boundary.
-def _hcn_to_hex(hcn: str) -> str:
-    """Convert a health card number to a hex string for storage."""
-    return hcn.encode("utf-8").hex()
+# Health card numbers are stored as raw UTF-8 (bytea) next to their keyed
+# hash (db.health_card_hash), which is what lookups and ON CONFLICT use.
+def _hcn_columns(hcn: str) -> Tuple[bytes, bytes]:
+    """(health_card_no, health_card_hash) column values for a health card number."""
+    return hcn.encode("utf-8"), health_card_hash(hcn)
 
-def _hcn_from_hex(h: str) -> str:
-    """Convert stored hex back to the original health card number."""
-    return bytes.fromhex(h).decode("utf-8")
+# Short-lived cache of health card number -> Patient. A doctor or pharmacist
+# usually looks the same patient up several times within a few seconds, and
+# patient rows rarely change. Writes through PatientRepo invalidate it.
+_PATIENT_CACHE: TTLCache = TTLCache(maxsize=512, ttl=60)
+_PATIENT_CACHE_LOCK = threading.Lock()
 
 class PatientRepo:
     @staticmethod
-    def create(p: Patient) -> Patient:
+    def create_if_absent(p: Patient) -> Optional[Patient]:
+        """
+        Insert the patient and its PATIENT_CREATED audit row in one statement,
+        unless the health card is already registered, in which case nothing is
+        written and None is returned. The uniqueness check, insert and audit
+        share one round-trip, so concurrent registrations cannot both succeed.
+        """
         sql = """
-        INSERT INTO patients (health_card_no, first_name, last_name, date_of_birth, phone, email)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        RETURNING id, created_at;
+        WITH ins AS (
+            INSERT INTO patients (health_card_no, health_card_hash, first_name, last_name,
+                                  date_of_birth, phone, email)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (health_card_hash) DO NOTHING
+            RETURNING id, created_at
+        ), audit AS (
+            INSERT INTO audit_log (event_type, payload)
+            SELECT 'PATIENT_CREATED', jsonb_build_object('patient_id', id, 'hcn', %s::text) FROM ins
+        )
+        SELECT id, created_at FROM ins;
         """
-        with db_cursor() as cur:
-            cur.execute(sql, (_hcn_to_hex(p.health_card_no), p.first_name, p.last_name,
-                              p.date_of_birth, p.phone, p.email))
+        with db_cursor(dict_cursor=False) as cur:
+            cur.execute(sql, (*_hcn_columns(p.health_card_no), p.first_name, p.last_name,
+                              p.date_of_birth, p.phone, p.email, p.health_card_no))
             row = cur.fetchone()
-        p.id = row["id"]
-        p.created_at = row["created_at"]
+        if not row:
+            return None
+        p.id, p.created_at = row
         return p
 
     @staticmethod
-    def get_by_health_card(hcn: str) -> Optional[Patient]:
+    def copy_create(rows: Iterable[tuple]) -> List[int]:
+        """
+        Bulk-load patients with binary COPY, for large imports. Rows are
+        (health_card_no, first_name, last_name, date_of_birth, phone, email);
+        they are COPYed into a temporary staging table and moved into patients
+        with one INSERT ... SELECT that skips existing health cards and writes
+        PATIENT_CREATED audit rows. Returns the ids of the inserted patients.
+        """
+        staging = """
+        CREATE TEMP TABLE patients_in (
+            health_card_no  BYTEA,
+            health_card_hash BYTEA,
+            first_name      VARCHAR(100),
+            last_name       VARCHAR(100),
+            date_of_birth   DATE,
+            phone           VARCHAR(30),
+            email           VARCHAR(255)
+        ) ON COMMIT DROP;
+        """
         sql = """
-        SELECT id, health_card_no, first_name, last_name, date_of_birth, phone, email, created_at
-        FROM patients
-        WHERE health_card_no = %s;
+        WITH ins AS (
+            INSERT INTO patients (health_card_no, health_card_hash, first_name, last_name,
+                                  date_of_birth, phone, email)
+            SELECT health_card_no, health_card_hash, first_name, last_name,
+                   date_of_birth, phone, email
+            FROM patients_in
+            ON CONFLICT (health_card_hash) DO NOTHING
+            RETURNING id, health_card_no
+        ), audit AS (
+            INSERT INTO audit_log (event_type, payload)
+            SELECT 'PATIENT_CREATED',
+                   jsonb_build_object('patient_id', id, 'hcn', convert_from(health_card_no, 'UTF8'))
+            FROM ins
+        )
+        SELECT id FROM ins;
         """
-        with db_cursor() as cur:
-            cur.execute(sql, (_hcn_to_hex(hcn),))
+        with db_cursor(dict_cursor=False) as cur:
+            cur.execute(staging)
+            copy_rows_binary(
+                cur,
+                "patients_in",
+                ("health_card_no", "health_card_hash", "first_name", "last_name",
+                 "date_of_birth", "phone", "email"),
+                ("bytea", "bytea", "text", "text", "date", "text", "text"),
+                (_hcn_columns(r[0]) + tuple(r[1:]) for r in rows),
+            )
+            cur.execute(sql)
+            return [r[0] for r in cur.fetchall()]
+
+    @staticmethod
+    def get_by_health_card(hcn: str) -> Optional[Patient]:
+        with _PATIENT_CACHE_LOCK:
+            cached = _PATIENT_CACHE.get(hcn)
+        if cached is not None:
+            return cached
+        with db_cursor(dict_cursor=False) as cur:
+            cur.execute(prepared_sql("hp_pat_by_hcn"), (health_card_hash(hcn),))
             row = cur.fetchone()
         if not row:
             return None
-        return Patient(
-            id=row["id"],
-            health_card_no=_hcn_from_hex(row["health_card_no"]),
-            first_name=row["first_name"],
-            last_name=row["last_name"],
-            date_of_birth=row["date_of_birth"],
-            phone=row["phone"],
-            email=row["email"],
-            created_at=row["created_at"],
-        )
+        # hp_pat_by_hcn returns Patient's fields in order, minus health_card_no
+        patient = Patient(row[0], hcn, *row[1:])
+        with _PATIENT_CACHE_LOCK:
+            _PATIENT_CACHE[hcn] = patient
+        return patient
+
+    @staticmethod
+    def invalidate_cached(hcn: Optional[str] = None) -> None:
+        """Drop one health card from the lookup cache, or all of them if hcn is None."""
+        with _PATIENT_CACHE_LOCK:
+            if hcn is None:
+                _PATIENT_CACHE.clear()
+            else:
+                _PATIENT_CACHE.pop(hcn, None)
     
     @staticmethod
     def get_by_id(patient_id: int) -> Optional[Patient]:
@@ -66,22 +140,46 @@ class PatientRepo:
         FROM patients
         WHERE id = %s;
         """
-        with db_cursor() as cur:
+        with db_cursor(dict_cursor=False) as cur:
             cur.execute(sql, (patient_id,))
             row = cur.fetchone()
         if not row:
             return None
-        return Patient(
-            id=row["id"],
-            health_card_no=_hcn_from_hex(row["health_card_no"]),
-            first_name=row["first_name"],
-            last_name=row["last_name"],
-            date_of_birth=row["date_of_birth"],
-            phone=row["phone"],
-            email=row["email"],
-            created_at=row["created_at"],
-        )
+        return Patient(row[0], bytes(row[1]).decode("utf-8"), *row[2:])
     
+    @staticmethod
+    def get_for_prescription(prescription_id: int) -> Optional[Patient]:
+        """Load the patient a prescription belongs to, joined in a single query."""
+        sql = """
+        SELECT pat.id, pat.health_card_no, pat.first_name, pat.last_name,
+               pat.date_of_birth, pat.phone, pat.email, pat.created_at
+        FROM prescriptions p
+        JOIN patients pat ON pat.id = p.patient_id
+        WHERE p.id = %s;
+        """
+        with db_cursor(dict_cursor=False) as cur:
+            cur.execute(sql, (prescription_id,))
+            row = cur.fetchone()
+        if not row:
+            return None
+        return Patient(row[0], bytes(row[1]).decode("utf-8"), *row[2:])
+
+    @staticmethod
+    def get_ids_by_health_cards(hcns: Iterable[str]) -> Dict[str, int]:
+        """Map health card numbers to patient ids with one query; unknown cards are absent."""
+        hashed = {health_card_hash(h): h for h in hcns}
+        if not hashed:
+            return {}
+        sql = """
+        SELECT id, health_card_hash
+        FROM patients
+        WHERE health_card_hash IN %s;
+        """
+        with db_cursor(dict_cursor=False) as cur:
+            cur.execute(sql, (tuple(hashed),))
+            rows = cur.fetchall()
+        return {hashed[bytes(h)]: pid for pid, h in rows}
+
     # Allows the pharmacist to fill in missing phone/email during notification.
     # Changes are persisted so future notifications do not need to prompt again.
     @staticmethod
@@ -90,68 +188,147 @@ class PatientRepo:
         phone: Optional[str] = None,
         email: Optional[str] = None,
     ) -> None:
-        updates = []
-        params = []
-        if phone is not None:
-            updates.append("phone = %s")
-            params.append(phone)
-        if email is not None:
-            updates.append("email = %s")
-            params.append(email)
-        if not updates:
+        if phone is None and email is None:
             return
-        sql = f"""
+        # None keeps the stored value, so one constant statement covers every case.
+        sql = """
         UPDATE patients
-        SET {", ".join(updates)}
+        SET phone = COALESCE(%s, phone),
+            email = COALESCE(%s, email)
         WHERE id = %s;
         """
-        params.append(patient_id)
         with db_cursor() as cur:
-            cur.execute(sql, tuple(params))
+            cur.execute(sql, (phone, email, patient_id))
+        # the cache is keyed by health card, not id; contact edits are rare
+        PatientRepo.invalidate_cached()
+
+    @staticmethod
+    def bulk_update_contact(rows: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> None:
+        """
+        Apply many (patient_id, phone, email) contact updates in one statement.
+        As with update_contact, a None phone or email keeps the stored value.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        sql = """
+        UPDATE patients AS p
+        SET phone = COALESCE(v.phone, p.phone),
+            email = COALESCE(v.email, p.email)
+        FROM (VALUES %s) AS v (id, phone, email)
+        WHERE p.id = v.id;
+        """
+        with db_cursor(dict_cursor=False) as cur:
+            execute_values(cur, sql, rows, template="(%s::int, %s::varchar, %s::varchar)",
+                           page_size=1000)
+        PatientRepo.invalidate_cached()
 
 
 class PrescriptionRepo:
     @staticmethod
-    def get_pickup_code_by_id(
-        prescription_id: int,
-    ) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    def claim_or_get_pickup(
+        prescription_id: int, new_code: str
+    ) -> Optional[Tuple[str, Optional[str], bool]]:
+        """
+        Give the prescription `new_code` unless it already has a pickup code, in
+        one statement. Returns None if the prescription does not exist, otherwise
+        (pickup_code, pickup_qr_path, created) where created is True when
+        `new_code` was stored.
+        """
         sql = """
-        SELECT pickup_code, pickup_qr_path
-        FROM prescriptions
-        WHERE id = %s;
+        UPDATE prescriptions
+        SET pickup_code = COALESCE(pickup_code, %s)
+        WHERE id = %s
+        RETURNING pickup_code, pickup_qr_path, pickup_code = %s AS created;
         """
-        with db_cursor() as cur:
-            cur.execute(sql, (prescription_id,))
-            row = cur.fetchone()
-        if not row:
-            return None
-        return row["pickup_code"], row["pickup_qr_path"]
+        with db_cursor(dict_cursor=False) as cur:
+            cur.execute(sql, (new_code, prescription_id, new_code))
+            return cur.fetchone()
     
     @staticmethod
-    def create(p: Prescription) -> Prescription:
+    def create_with_audit(p: Prescription) -> Prescription:
+        """
+        Insert the prescription and its RX_CREATED audit row in one statement.
+        """
         sql = """
-        INSERT INTO prescriptions (patient_id, drug_name, dosage, instructions, status, pickup_code, expires_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        RETURNING id, created_at;
+        WITH ins AS (
+            INSERT INTO prescriptions (patient_id, drug_name, dosage, instructions, status, pickup_code, expires_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, patient_id, created_at
+        ), audit AS (
+            INSERT INTO audit_log (event_type, payload)
+            SELECT 'RX_CREATED', jsonb_build_object('prescription_id', id, 'patient_id', patient_id)
+            FROM ins
+        )
+        SELECT id, created_at FROM ins;
         """
         with db_cursor() as cur:
             cur.execute(sql, (p.patient_id, p.drug_name, p.dosage,
-                              p.instructions, p.status, p.pickup_code, p.expires_at))
+                              p.instructions, int(p.status), p.pickup_code, p.expires_at))
             row = cur.fetchone()
         p.id = row["id"]
         p.created_at = row["created_at"]
         return p
 
     @staticmethod
-    def update_pickup_qr(prescription_id: int, pickup_code: str, qr_path: str) -> None:
+    def copy_create(rows: Iterable[tuple]) -> List[int]:
+        """
+        Bulk-load prescriptions with binary COPY, for large imports. Rows are
+        (patient_id, drug_name, dosage, instructions, status, expires_at); they
+        are COPYed into a staging table and moved into prescriptions with one
+        INSERT ... SELECT that also writes RX_CREATED audit rows. Returns the
+        new ids.
+        """
+        staging = """
+        CREATE TEMP TABLE prescriptions_in (
+            patient_id      INTEGER,
+            drug_name       VARCHAR(255),
+            dosage          VARCHAR(255),
+            instructions    TEXT,
+            status          SMALLINT,
+            expires_at      TIMESTAMPTZ
+        ) ON COMMIT DROP;
+        """
+        sql = """
+        WITH ins AS (
+            INSERT INTO prescriptions (patient_id, drug_name, dosage, instructions, status, expires_at)
+            SELECT patient_id, drug_name, dosage, instructions, status, expires_at
+            FROM prescriptions_in
+            RETURNING id, patient_id
+        ), audit AS (
+            INSERT INTO audit_log (event_type, payload)
+            SELECT 'RX_CREATED', jsonb_build_object('prescription_id', id, 'patient_id', patient_id)
+            FROM ins
+        )
+        SELECT id FROM ins;
+        """
+        with db_cursor(dict_cursor=False) as cur:
+            cur.execute(staging)
+            copy_rows_binary(
+                cur,
+                "prescriptions_in",
+                ("patient_id", "drug_name", "dosage", "instructions", "status", "expires_at"),
+                ("int4", "text", "text", "text", "int2", "timestamptz"),
+                rows,
+            )
+            cur.execute(sql)
+            return [r[0] for r in cur.fetchall()]
+
+    @staticmethod
+    def update_pickup_qr(prescription_id: int, pickup_code: str, qr_path: str) -> bool:
+        """
+        Record the QR image for the prescription's current pickup code. Returns
+        False if a path was already stored (or the code changed), so only one
+        render per code is treated as the one that generated the QR.
+        """
         sql = """
         UPDATE prescriptions
-        SET pickup_code = %s,
-            pickup_qr_path = %s
-        WHERE id = %s;
+        SET pickup_qr_path = %s
+        WHERE id = %s AND pickup_code = %s AND pickup_qr_path IS NULL;
         """
         with db_cursor() as cur:
-            cur.execute(sql, (pickup_code, qr_path, prescription_id))
+            cur.execute(sql, (qr_path, prescription_id, pickup_code))
+            return cur.rowcount == 1
 
     @staticmethod
     def list_for_patient(patient_id: int) -> List[Prescription]:
@@ -162,100 +339,73 @@ class PrescriptionRepo:
         WHERE patient_id = %s
         ORDER BY created_at DESC;
         """
-        with db_cursor() as cur:
+        # Columns are in Prescription field order: build rows positionally.
+        with db_cursor(dict_cursor=False) as cur:
             cur.execute(sql, (patient_id,))
             rows = cur.fetchall()
-        result = []
-        for r in rows:
-            result.append(
-                Prescription(
-                    id=r["id"],
-                    patient_id=r["patient_id"],
-                    drug_name=r["drug_name"],
-                    dosage=r["dosage"],
-                    instructions=r["instructions"],
-                    status=r["status"],
-                    pickup_code=r["pickup_code"],
-                    pickup_qr_path=r["pickup_qr_path"],
-                    expires_at=r["expires_at"],
-                    created_at=r["created_at"],
-                    picked_up_at=r["picked_up_at"],
-                )
-            )
-        return result
+        return [Prescription(*r[:5], RxStatus(r[5]), *r[6:]) for r in rows]
     
     @staticmethod
-    def get_by_pickup_code(code: str) -> Optional[Prescription]:
+    def list_for_patient_summary(patient_id: int) -> List[PrescriptionSummary]:
+        """Like list_for_patient, but only the columns a listing shows."""
         sql = """
-        SELECT id, patient_id, drug_name, dosage, instructions, status,
-               pickup_code, pickup_qr_path, expires_at, created_at, picked_up_at
+        SELECT id, drug_name, dosage, status, pickup_code, created_at
         FROM prescriptions
-        WHERE pickup_code = %s;
+        WHERE patient_id = %s
+        ORDER BY created_at DESC;
+        """
+        with db_cursor(dict_cursor=False) as cur:
+            cur.execute(sql, (patient_id,))
+            rows = cur.fetchall()
+        return [
+            PrescriptionSummary(pid, drug_name, dosage, RxStatus(status), code, created_at)
+            for pid, drug_name, dosage, status, code, created_at in rows
+        ]
+
+    @staticmethod
+    def dispense_by_pickup_code(code: str) -> Optional[Tuple[RxStatus, bool, bool]]:
+        """
+        Dispense the prescription with this pickup code in one statement: the
+        lookup, the status/expiry checks, the update and the RX_DISPENSED audit
+        row all happen in a single round-trip.
+
+        Returns None if no prescription has the code, otherwise
+        (status_before, expired, dispensed); dispensed is False when the
+        prescription was already dispensed or has expired.
         """
+        # SQL lives in db._PREPARED["hp_rx_dispense"] (prepared per connection
+        # when HP_DB_PREPARE=1)
         with db_cursor() as cur:
-            cur.execute(sql, (code,))
+            cur.execute(prepared_sql("hp_rx_dispense"), (code,))
             row = cur.fetchone()
         if not row:
             return None
-        return Prescription(
-            id=row["id"],
-            patient_id=row["patient_id"],
-            drug_name=row["drug_name"],
-            dosage=row["dosage"],
-            instructions=row["instructions"],
-            status=row["status"],
-            pickup_code=row["pickup_code"],
-            pickup_qr_path=row["pickup_qr_path"],
-            expires_at=row["expires_at"],
-            created_at=row["created_at"],
-            picked_up_at=row["picked_up_at"],
-        )
+        return RxStatus(row["status"]), row["expired"], row["dispensed"]
 
     @staticmethod
-    def mark_dispensed(prescription_id: int) -> None:
-        sql = """
-        UPDATE prescriptions
-        SET status = 'DISPENSED',
-            picked_up_at = NOW()
-        WHERE id = %s;
-        """
-        with db_cursor() as cur:
-            cur.execute(sql, (prescription_id,))
-    
-    @staticmethod
-    def list_dispensed() -> List[Prescription]:
+    def iter_dispensed() -> Iterator[tuple]:
         """
-        Return all dispensed prescriptions, most recent first.
+        Stream dispensed prescriptions as plain tuples in report column order:
+        (id, patient_id, first_name, last_name, drug_name, dosage, status,
+         pickup_code, picked_up_at, created_at, expires_at).
+        Uses a server-side cursor so only one fetch batch is held in memory, and
+        skips building Prescription objects.
         """
         sql = """
-        SELECT id, patient_id, drug_name, dosage, instructions, status,
-               pickup_code, pickup_qr_path, expires_at, created_at, picked_up_at
-        FROM prescriptions
-        WHERE status = 'DISPENSED'
-        ORDER BY picked_up_at DESC NULLS LAST, created_at DESC;
+        SELECT p.id, p.patient_id, pat.first_name, pat.last_name, p.drug_name, p.dosage,
+               p.status, p.pickup_code, p.picked_up_at, p.created_at, p.expires_at
+        FROM prescriptions p
+        JOIN patients pat ON pat.id = p.patient_id
+        WHERE p.status = 2  -- RxStatus.DISPENSED
+        -- Served in order by ix_prescriptions_dispensed; keep WHERE/ORDER BY in
+        -- step with that index or this becomes a seq scan plus sort.
+        ORDER BY p.picked_up_at DESC NULLS LAST, p.created_at DESC;
         """
-        with db_cursor() as cur:
+        with db_cursor(dict_cursor=False, name="dispensed_report") as cur:
+            cur.itersize = 2000
             cur.execute(sql)
-            rows = cur.fetchall()
-        result: List[Prescription] = []
-        for r in rows:
-            result.append(
-                Prescription(
-                    id=r["id"],
-                    patient_id=r["patient_id"],
-                    drug_name=r["drug_name"],
-                    dosage=r["dosage"],
-                    instructions=r["instructions"],
-                    status=r["status"],
-                    pickup_code=r["pickup_code"],
-                    pickup_qr_path=r["pickup_qr_path"],
-                    expires_at=r["expires_at"],
-                    created_at=r["created_at"],
-                    picked_up_at=r["picked_up_at"],
-                )
-            )
-        return result
-    
+            yield from cur
+
     @staticmethod
     def get_by_id(prescription_id: int) -> Optional[Prescription]:
         sql = """
@@ -264,34 +414,37 @@ class PrescriptionRepo:
         FROM prescriptions
         WHERE id = %s;
         """
-        with db_cursor() as cur:
+        with db_cursor(dict_cursor=False) as cur:
             cur.execute(sql, (prescription_id,))
             row = cur.fetchone()
         if not row:
             return None
-        return Prescription(
-            id=row["id"],
-            patient_id=row["patient_id"],
-            drug_name=row["drug_name"],
-            dosage=row["dosage"],
-            instructions=row["instructions"],
-            status=row["status"],
-            pickup_code=row["pickup_code"],
-            pickup_qr_path=row["pickup_qr_path"],
-            expires_at=row["expires_at"],
-            created_at=row["created_at"],
-            picked_up_at=row["picked_up_at"],
-        )
+        return Prescription(*row[:5], RxStatus(row[5]), *row[6:])
     
 # Single entry point for writing to audit_log. All important actions (patient created,
 # prescription created, notify, dispense, report export) call this for traceability.
+# Event fields are passed as keyword arguments and stored as a JSONB payload.
+# Events are queued and written in batches by audit_async unless HP_AUDIT_SYNC=1;
+# AuditRepo.flush() forces queued events out (the CLI does this on exit);
+# event types listed in HP_AUDIT_DISABLED are dropped before any work is done.
 class AuditRepo:
     @staticmethod
-    def record_event(audit_log: AuditLog) -> None:
+    def record_event(event_type: str, **fields) -> None:
+        settings = get_config().audit
+        if event_type in settings.disabled:
+            return
+        if not settings.sync:
+            audit_async.enqueue(event_type, fields)
+            return
         sql = """
         INSERT INTO audit_log (event_type, payload)
         VALUES (%s, %s);
         """
         with db_cursor() as cur:
-            cur.execute(sql, (audit_log.event_type, audit_log.payload))
+            cur.execute(sql, (event_type, Json(fields)))
+
+    @staticmethod
+    def flush(timeout: float = 5.0) -> bool:
+        """Block until queued audit events are written (no-op with HP_AUDIT_SYNC=1)."""
+        return audit_async.flush_audit(timeout)
 
@@ -1,9 +1,11 @@
 from datetime import date
-from typing import Optional
+from typing import Iterable, List, Optional
 from models import Patient
 from repositories import PatientRepo
 
 #  register a new patient using their health card number and personal details
+#  (the duplicate check, the insert and the PATIENT_CREATED audit row are one
+#  statement)
 def register_patient(
     health_card_no: str,
     first_name: str,
@@ -12,9 +14,6 @@ def register_patient(
     phone: Optional[str],
     email: Optional[str],
 ) -> Patient:
-    existing = PatientRepo.get_by_health_card(health_card_no)
-    if existing is not None:
-        raise ValueError("Patient with this health card already exists")
     patient = Patient(
         id=None,
         health_card_no=health_card_no,
@@ -24,4 +23,14 @@ def register_patient(
         phone=phone,
         email=email,
     )
-    return PatientRepo.create(patient)
+    created = PatientRepo.create_if_absent(patient)
+    if created is None:
+        raise ValueError("Patient with this health card already exists")
+    return created
+
+
+#  register many patients at once (e.g. CSV import); rows are
+#  (health_card_no, first_name, last_name, dob, phone, email) and health cards
+#  that already exist are skipped
+def register_patients_bulk(rows: Iterable[tuple]) -> List[int]:
+    return PatientRepo.copy_create(rows)
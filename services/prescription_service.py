@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List
-from models import Prescription
-from repositories import PrescriptionRepo
+from typing import Iterable, Optional, List, Tuple
+from models import Prescription, PrescriptionSummary, RxStatus
+from repositories import PatientRepo, PrescriptionRepo
 
 def create_prescription_for_patient(
     patient_id: int,
@@ -18,10 +18,32 @@ def create_prescription_for_patient(
         drug_name=drug_name,
         dosage=dosage,
         instructions=instructions,
-        status="ACTIVE",
+        status=RxStatus.ACTIVE,
         expires_at=expires_at,
     )
-    return PrescriptionRepo.create(p)
+    # RX_CREATED is audited in the same statement as the insert
+    return PrescriptionRepo.create_with_audit(p)
+
+# Create many prescriptions at once (e.g. CSV import). Rows are
+# (health_card_no, drug_name, dosage, instructions, days_valid); patients are
+# resolved with one query per batch. Returns (created ids, unknown health cards).
+def create_prescriptions_bulk(rows: Iterable[tuple]) -> Tuple[List[int], List[str]]:
+    rows = list(rows)
+    patient_ids = PatientRepo.get_ids_by_health_cards({r[0] for r in rows})
+    now = datetime.now(timezone.utc)
+    values = []
+    unknown = []
+    for hcn, drug_name, dosage, instructions, days_valid in rows:
+        patient_id = patient_ids.get(hcn)
+        if patient_id is None:
+            unknown.append(hcn)
+            continue
+        values.append((patient_id, drug_name, dosage, instructions, int(RxStatus.ACTIVE),
+                       now + timedelta(days=days_valid)))
+    return PrescriptionRepo.copy_create(values), unknown
 
 def list_prescriptions(patient_id: int) -> List[Prescription]:
     return PrescriptionRepo.list_for_patient(patient_id)
+
+def list_prescription_summaries(patient_id: int) -> List[PrescriptionSummary]:
+    return PrescriptionRepo.list_for_patient_summary(patient_id)
@@ -1,68 +1,114 @@
-import uuid
-from urllib.parse import urlencode
+import base64
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-import requests
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 
-from repositories import PrescriptionRepo, AuditRepo 
+import segno
+
+from repositories import PrescriptionRepo, AuditRepo
 
 QR_OUTPUT_DIR = "qr_codes"
-QR_BASE_URL = "https://api.qrserver.com/v1/create-qr-code/"
 
+# Renders QR images, stores their path and audits QR_GENERATED off the caller's
+# thread. Pending renders finish before the interpreter exits.
+EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="qr-render")
 
-def _ensure_output_dir() -> Path:
-    p = Path(QR_OUTPUT_DIR)
-    p.mkdir(parents=True, exist_ok=True)
-    return p
+# prescription_id -> render still in progress, so concurrent callers share one.
+_IN_FLIGHT: Dict[int, Future] = {}
+# RLock: a render that is already done runs its callback inside _submit_render.
+_IN_FLIGHT_LOCK = threading.RLock()
 
 
-def generate_pickup_code() -> str:
-    return uuid.uuid4().hex[:10].upper()
+# Created on first use; later calls skip the mkdir syscall.
+_OUT_DIR: Path | None = None
 
 
-def ensure_pickup_code_and_qr(prescription_id: int) -> Tuple[str, str]:
-    """
-    Ensures a prescription has both a pickup code and a QR image.
-    If they already exist, reuse them; otherwise generate a new code, call the
-    third-party QR API, save the PNG, and update the DB.
-    This function is used by both QR generation and notification workflows.
-    """
+def _ensure_output_dir() -> Path:
+    global _OUT_DIR
+    if _OUT_DIR is None:
+        p = Path(QR_OUTPUT_DIR)
+        p.mkdir(parents=True, exist_ok=True)
+        _OUT_DIR = p
+    return _OUT_DIR
 
-    existing = PrescriptionRepo.get_pickup_code_by_id(prescription_id)
-    if existing is not None:
-        code, path = existing
-        if code and path:
-            return code, path
 
-    # otherwise generate new QR
-    pickup_code = generate_pickup_code()
-    params = {"size": "200x200", "data": pickup_code}
-    url = f"{QR_BASE_URL}?{urlencode(params)}"
+def generate_pickup_code() -> str:
+    # 48 random bits -> 10 base32 chars (A-Z, 2-7; already upper case)
+    return base64.b32encode(os.urandom(6)).decode()[:10]
 
-    out_dir = _ensure_output_dir()
-    filename = f"prescription_{prescription_id}_{pickup_code}.png"
-    out_path = out_dir / filename
 
-    resp = requests.get(url, timeout=10)
-    resp.raise_for_status()
+def _qr_path(prescription_id: int, pickup_code: str) -> Path:
+    return _ensure_output_dir() / f"prescription_{prescription_id}_{pickup_code}.png"
 
-    with open(out_path, "wb") as f:
-        f.write(resp.content)
 
-    PrescriptionRepo.update_pickup_qr(
+def _render_and_persist_qr(prescription_id: int, pickup_code: str) -> str:
+    """
+    Worker: render the PNG, store its path, and audit QR_GENERATED. Errors
+    propagate through the Future; the pickup code is already saved, so the
+    next ensure_pickup_code_and_qr call renders again.
+    """
+    out_path = _qr_path(prescription_id, pickup_code)
+    segno.make(pickup_code, error="M").save(out_path, scale=5)
+    stored = PrescriptionRepo.update_pickup_qr(
         prescription_id=prescription_id,
         pickup_code=pickup_code,
         qr_path=str(out_path),
     )
+    if stored:
+        AuditRepo.record_event(
+            "QR_GENERATED",
+            prescription_id=prescription_id,
+            pickup_code=pickup_code,
+            path=str(out_path),
+        )
+    return str(out_path)
+
+
+def _submit_render(prescription_id: int, pickup_code: str) -> Future:
+    """Start a render for the prescription, or join the one already running."""
+    with _IN_FLIGHT_LOCK:
+        future = _IN_FLIGHT.get(prescription_id)
+        if future is None:
+            future = EXECUTOR.submit(_render_and_persist_qr, prescription_id, pickup_code)
+            _IN_FLIGHT[prescription_id] = future
+            future.add_done_callback(lambda _f: _forget_render(prescription_id, _f))
+        return future
+
+
+def _forget_render(prescription_id: int, future: Future) -> None:
+    with _IN_FLIGHT_LOCK:
+        if _IN_FLIGHT.get(prescription_id) is future:
+            del _IN_FLIGHT[prescription_id]
+
+
+def ensure_pickup_code_and_qr(prescription_id: int) -> Tuple[str, str, Optional[Future]]:
+    """
+    Ensures a prescription has both a pickup code and a QR image.
+    Returns (pickup_code, qr_path, render). If both already exist, render is
+    None. Otherwise the pickup code is saved right away and the QR PNG is
+    rendered in the background (EXECUTOR): qr_path is where the image will
+    appear, and render is the Future to wait on for success or failure.
+    This function is used by both QR generation and notification workflows.
+    """
 
-    AuditRepo.record_event(
-        "QR_GENERATED",
-        f"prescription_id={prescription_id};pickup_code={pickup_code};path={out_path}",
-    )
+    claimed = PrescriptionRepo.claim_or_get_pickup(prescription_id, generate_pickup_code())
+    if claimed is None:
+        raise ValueError(f"Prescription {prescription_id} not found.")
+    pickup_code, path, created = claimed
+    if not created and path:
+        return pickup_code, path, None
 
-    return pickup_code, str(out_path)
+    # New code, or an existing code whose earlier render did not finish; the
+    # existing code is kept since it may already have been sent to the patient.
+    render = _submit_render(prescription_id, pickup_code)
+    return pickup_code, str(_qr_path(prescription_id, pickup_code)), render
 
 
 def generate_qr_for_prescription(prescription_id: int) -> str:
-        pickup_code, path = ensure_pickup_code_and_qr(prescription_id)
-        return path
+    """Ensure the QR image exists, waiting for the render; raises if it failed."""
+    _, path, render = ensure_pickup_code_and_qr(prescription_id)
+    if render is not None:
+        render.result()
+    return path
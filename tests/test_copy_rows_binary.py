@@ -0,0 +1,98 @@
+"""
+Byte-level checks for db.copy_rows_binary, the hand-written PGCOPY encoder
+used by the CSV bulk imports. No database is needed: a fake cursor captures
+what would be sent with COPY ... FROM STDIN.
+
+Run with: python -m unittest discover -s tests -t .
+"""
+
+import unittest
+from datetime import date, datetime, timedelta, timezone
+
+try:
+    import db
+except ImportError:  # psycopg2 not installed
+    db = None
+
+
+class _CapturingCursor:
+    def __init__(self):
+        self.sql = None
+        self.data = None
+
+    def copy_expert(self, sql, buf):
+        self.sql = sql
+        self.data = buf.read()
+
+
+HEADER = b"PGCOPY\n\xff\r\n\x00" + b"\x00\x00\x00\x00" + b"\x00\x00\x00\x00"
+TRAILER = b"\xff\xff"
+NULL = b"\xff\xff\xff\xff"
+
+
+@unittest.skipIf(db is None, "psycopg2 is not installed")
+class CopyRowsBinaryTest(unittest.TestCase):
+    def _copy(self, types, rows):
+        cur = _CapturingCursor()
+        db.copy_rows_binary(cur, "t", [f"c{i}" for i in range(len(types))], types, rows)
+        return cur
+
+    def test_sql_names_table_and_columns(self):
+        cur = self._copy(("int4", "text"), [])
+        self.assertEqual(cur.sql, "COPY t (c0, c1) FROM STDIN WITH (FORMAT BINARY)")
+
+    def test_no_rows_is_header_and_trailer(self):
+        self.assertEqual(self._copy(("int4",), []).data, HEADER + TRAILER)
+
+    def test_row_with_null_date_and_timestamptz(self):
+        row = (
+            1,
+            None,
+            "hé",
+            date(2000, 1, 2),                                 # 1 day after the PG epoch
+            datetime(2000, 1, 1, 0, 0, 1, tzinfo=timezone.utc),  # 1 second after
+            7,
+        )
+        cur = self._copy(("int4", "text", "text", "date", "timestamptz", "int2"), [row])
+        expected = (
+            HEADER
+            + b"\x00\x06"                                              # field count
+            + b"\x00\x00\x00\x04" + b"\x00\x00\x00\x01"                # int4 1
+            + NULL                                                     # NULL text
+            + b"\x00\x00\x00\x03" + b"h\xc3\xa9"                       # UTF-8 text
+            + b"\x00\x00\x00\x04" + b"\x00\x00\x00\x01"                # date: 1 day
+            + b"\x00\x00\x00\x08" + b"\x00\x00\x00\x00\x00\x0f\x42\x40"  # 1_000_000 us
+            + b"\x00\x00\x00\x02" + b"\x00\x07"                        # int2 7
+            + TRAILER
+        )
+        self.assertEqual(cur.data, expected)
+
+    def test_values_before_epoch_and_naive_timestamps(self):
+        rows = [
+            (date(1999, 12, 31), datetime(1999, 12, 31, 23, 59, 59)),  # naive = UTC
+            (date(2000, 1, 1),
+             datetime(2000, 1, 1, 1, 0, 0, tzinfo=timezone(timedelta(hours=1)))),
+        ]
+        cur = self._copy(("date", "timestamptz"), rows)
+        expected = (
+            HEADER
+            + b"\x00\x02"
+            + b"\x00\x00\x00\x04" + b"\xff\xff\xff\xff"                # date: -1 day
+            + b"\x00\x00\x00\x08" + b"\xff\xff\xff\xff\xff\xf0\xbd\xc0"  # -1_000_000 us
+            + b"\x00\x02"
+            + b"\x00\x00\x00\x04" + b"\x00\x00\x00\x00"                # the epoch itself
+            + b"\x00\x00\x00\x08" + b"\x00\x00\x00\x00\x00\x00\x00\x00"  # 01:00+01 = epoch
+            + TRAILER
+        )
+        self.assertEqual(cur.data, expected)
+
+    def test_bytea_is_sent_verbatim(self):
+        cur = self._copy(("bytea",), [(b"\x00\x01\xff",)])
+        self.assertEqual(
+            cur.data,
+            HEADER + b"\x00\x01" + b"\x00\x00\x00\x03" + b"\x00\x01\xff" + TRAILER,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()